@@ -1,16 +1,22 @@
-from typing import Literal, TypedDict
+from typing import Literal, Optional, TypedDict
+import contextlib
 import functools
 import os
+import re
 from dotenv import load_dotenv
 
 # Load .env from project root
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
 
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
+try:
+    from langchain_anthropic import ChatAnthropic
+except ImportError:  # Anthropic backend is optional
+    ChatAnthropic = None
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 from state import AgentState
 from tools import perform_clustering, generate_visualization, clean_data, perform_eda
@@ -18,6 +24,8 @@ from tools import perform_clustering, generate_visualization, clean_data, perfor
 # 1. Define LLM
 # Using gpt-4o-mini as a robust default for orchestration
 llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+# Anthropic needs explicit cache_control breakpoints; OpenAI caches prefixes automatically.
+provider = "anthropic" if ChatAnthropic is not None and isinstance(llm, ChatAnthropic) else "openai"
 
 # 2. Define Specialist Agents
 cleaning_agent = create_react_agent(
@@ -43,20 +51,16 @@ visualization_agent = create_react_agent(
 
 # 3. Define the Supervisor Node
 # This node decides who goes next based on the history
-members = ["cleaning_agent", "clustering_agent", "visualization_agent"]
-options = members + ["FINISH"]
+# Kept as a tuple so the ordering (and therefore the prompt text) never changes.
+members = ("cleaning_agent", "clustering_agent", "visualization_agent")
+options = members + ("FINISH",)
 
-def supervisor_node(state: AgentState):
-    """
-    Acts as the orchestrator. It receives the user's natural language request 
-    and decides which specialist agent to call next.
-    """
-    messages = [
-        SystemMessage(content=f"""You are a dedicated Autonomous Data Analytics Manager. 
+# Static instructions are kept as a stable prefix so OpenAI's automatic prompt
+# cache can reuse them across turns.
+STATIC_RULES = f"""You are a dedicated Autonomous Data Analytics Manager. 
         Your goal is to COMPLETELY execute the user's requested workflow without stopping for human input until the very end.
         
-        Current members: {members}
-        Active Data File: {state.get('df_path', 'None')}
+        Current members: {list(members)}
         
         THE PLAN (Execute in Order):
         1. CHECK DATA: If nulls/outliers exist -> call cleaning_agent.
@@ -71,12 +75,88 @@ def supervisor_node(state: AgentState):
         - If the cleaning agent says "ready for clustering", YOU MUST CALL clustering_agent.
         - DO NOT CALL FINISH until you see a 'Cluster Visualization' or 'Scatter Plot' in the history.
         
-        Reply ONLY with the name of the next agent or FINISH.""")
-    ] + state["messages"]
+        Reply ONLY with the name of the next agent or FINISH."""
+
+# Keyword signals emitted by the specialists/tools. Compiled once at import time.
+# Only matched against ToolMessages: AI summaries end with "ready for [Next Step]" and
+# routinely mention plots that haven't been produced yet.
+_VIZ_DONE_RE = re.compile(r"^visualization generated", re.IGNORECASE)
+_CLUSTERED_RE = re.compile(r"^clustering complete", re.IGNORECASE)
+_READY_FOR_CLUSTER_RE = re.compile(r"ready for clustering", re.IGNORECASE)
+_WANTS_CLUSTER_RE = re.compile(r"cluster", re.IGNORECASE)
+_WANTS_VIZ_RE = re.compile(r"visuali[sz]|plot", re.IGNORECASE)
+
+# Only a handful of tokens are needed to spell out an agent name; the cap leaves
+# room for a short chatty reply, and supervisor_node retries uncapped if needed.
+llm_router = llm.bind(max_tokens=16)
+
+def _route_by_keywords(state: AgentState) -> Optional[str]:
+    """
+    Deterministic routing based on what the specialists reported since the
+    latest user request. Returns None when the situation is ambiguous and the
+    LLM should decide.
+    """
+    messages = state["messages"]
+    if not messages or not isinstance(messages[-1], AIMessage):
+        return None
+
+    # Only consider the current request; earlier turns in the thread may already contain a finished workflow
+    req_idx = next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)), -1)
+    request = messages[req_idx].content if req_idx >= 0 else ""
+    recent = [m for m in messages[req_idx + 1:] if isinstance(m.content, str)]
+    since_request = [m.content for m in recent]
+    if not isinstance(request, str) or not since_request:
+        return None
+
+    # Signals are taken from ToolMessages of specific tools only; free-text AI summaries
+    # mention paths and plots whether or not the step actually succeeded.
+    viz_attempts = [m for m in recent if isinstance(m, ToolMessage) and m.name == "generate_visualization"]
+    clustered = any(
+        isinstance(m, ToolMessage) and m.name == "perform_clustering" and _CLUSTERED_RE.search(m.content)
+        for m in recent
+    )
+
+    # generate_visualization succeeded in the last few messages -> nothing left to do
+    if any(
+        isinstance(m, ToolMessage) and m.name == "generate_visualization" and _VIZ_DONE_RE.search(m.content)
+        for m in recent[-3:]
+    ):
+        return "FINISH"
+    # A visualization was attempted (and failed, or something ran after it): let the LLM decide
+    if viz_attempts:
+        return None
+
+    last = since_request[-1]
+    if clustered:
+        return "visualization_agent" if _WANTS_VIZ_RE.search(request) else "FINISH"
+    if _READY_FOR_CLUSTER_RE.search(last) and _WANTS_CLUSTER_RE.search(request):
+        return "clustering_agent"
+    return None
+
+async def supervisor_node(state: AgentState):
+    """
+    Acts as the orchestrator. It receives the user's natural language request 
+    and decides which specialist agent to call next.
+    """
+    # Cheap path first: skip the LLM entirely when the next step is obvious
+    detected_agent = _route_by_keywords(state)
+    if detected_agent is not None:
+        return {"next_node": detected_agent}
+
+    # The active file path changes as the data is cleaned/clustered, so it goes
+    # AFTER the history to keep the cacheable prefix (rules + history) intact.
+    # It's a HumanMessage because Anthropic rejects non-consecutive system messages.
+    messages = [SystemMessage(content=STATIC_RULES)] + list(state["messages"]) + [
+        HumanMessage(content=f"Active Data File: {state.get('df_path', 'None')}")
+    ]
 
     # Simple logic-based routing or LLM-based. Let's use LLM for "Supervisor Pattern"
-    response = llm.invoke(messages)
+    response = await llm_router.ainvoke(messages)
     content = response.content.strip()
+    if not any(option in content for option in options):
+        # Reply was cut off before naming an option; don't let truncation become a silent FINISH
+        response = await llm.ainvoke(messages)
+        content = response.content.strip()
     
     # Validation with Robust Parsing
     # If the LLM is chatty (e.g., "I will call clustering_agent"), we need to extract the agent name.
@@ -97,17 +177,17 @@ def supervisor_node(state: AgentState):
     return {"next_node": detected_agent}
 
 # 4. Agent Execution Helpers
-def run_specialist(state: AgentState, name: str, agent):
-    """Bridge function to run a specialist and update the global state."""
-    # Inject ABSOLUTE data file path and instructions to return control to supervisor
-    current_path = state.get("df_path", "No file uploaded")
-    
-    # We add a very specific instruction to break the ReACT loop once tools are called
-    # but without implying that the entire project is over.
-    context_msg = SystemMessage(content=f"""
-    IMPORTANT: The currently active data file path is: {current_path}. 
-    This is an ABSOLUTE PATH. You MUST use this EXACT string for all tool 'file_path' arguments.
-    
+# Tool outputs report "Saved to: <path>". Match both unix and windows paths
+# (non-greedy, so paths with spaces work) ending in .csv/.parquet.
+_SAVED_RE = re.compile(r"saved to:\s*(.*?\.(?:csv|parquet))", re.IGNORECASE)
+
+# Number of most recent messages a specialist sees
+SPECIALIST_HISTORY_WINDOW = 20
+
+# We add a very specific instruction to break the ReACT loop once tools are called
+# but without implying that the entire project is over.
+# Static part comes first so it can be cached; the active path is appended after it.
+_STATIC_SPECIALIST_RULES = """
     INSTRUCTIONS:
     1. If you use 'clean_data', it will save a new file (identifiable by '_cleaned' in the path).
     2. If you see high correlations in 'perform_eda', use 'clean_data' ONCE more with 'drop_columns' (using the SUGGESTED DROPS from the EDA report) to fix them.
@@ -115,18 +195,50 @@ def run_specialist(state: AgentState, name: str, agent):
     4. REPORT: "Task Complete. Data is ready for [Next Step]."
     5. FORBIDDEN: Do NOT ask the user "How would you like to proceed?". Do NOT saying "Let me know". Just report facts and exit.
     6. DO NOT loop indefinitely. Perform the action, summarize, and exit.
-    """)
+    """
+
+def _dynamic_path_block(path: str) -> str:
+    """Per-call part of the specialist context: the active data file path."""
+    return f"""
+    IMPORTANT: The currently active data file path is: {path}. 
+    This is an ABSOLUTE PATH. You MUST use this EXACT string for all tool 'file_path' arguments.
+    """
+
+async def run_specialist(state: AgentState, name: str, agent):
+    """Bridge function to run a specialist and update the global state."""
+    # Inject ABSOLUTE data file path and instructions to return control to supervisor
+    current_path = state.get("df_path", "No file uploaded")
     
-    # Create a local state with the injected message
-    local_state = state.copy()
-    local_state["messages"] = list(local_state["messages"]) + [context_msg]
+    if provider == "anthropic":
+        # Mark the static block as a cache breakpoint so it is reused across ReACT iterations
+        context_msg = SystemMessage(content=[
+            {"type": "text", "text": _STATIC_SPECIALIST_RULES, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": _dynamic_path_block(current_path)},
+        ])
+    else:
+        context_msg = SystemMessage(content=_STATIC_SPECIALIST_RULES + _dynamic_path_block(current_path))
+    
+    # Only the recent history goes to the specialist; the add_messages reducer merges
+    # the returned delta back into the full history. Don't start on a ToolMessage
+    # whose originating tool call was sliced off.
+    history = state["messages"][-SPECIALIST_HISTORY_WINDOW:]
+    start = 0
+    while start < len(history) and isinstance(history[start], ToolMessage):
+        start += 1
+    history = history[start:]
+    # Always keep the user's latest ask (e.g. "3 groups") even if it fell out of the window
+    request = next((m for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), None)
+    if request is not None and not any(m is request for m in history):
+        history = [request, *history]
+    local_state = {"messages": [*history, context_msg]}
     
     # Record current message count to extract ONLY new ones later
     history_len = len(local_state["messages"])
     
     # Use a high recursion limit for the session
     config = {"recursion_limit": 50}
-    result = agent.invoke(local_state, config=config)
+    # Awaited rather than called synchronously; the graph itself is still sequential
+    result = await agent.ainvoke(local_state, config=config)
     
     # Extract ONLY new messages added by the specialist
     new_messages = result["messages"][history_len:]
@@ -134,15 +246,10 @@ def run_specialist(state: AgentState, name: str, agent):
     # Extract file path from tool output if possible (detecting absolute paths)
     df_path = state.get("df_path", "")
     for m in reversed(new_messages):
-        if hasattr(m, "content"):
-            last_msg = m.content
-            if "saved to:" in last_msg.lower():
-                import re
-                # Match both unix and windows paths (detects .csv at end)
-                match = re.search(r"saved to: (.*?\.csv)", last_msg)
-                if match:
-                    df_path = match.group(1).strip()
-                    break
+        match = _SAVED_RE.search(m.content) if isinstance(getattr(m, "content", None), str) else None
+        if match:
+            df_path = match.group(1).strip()
+            break
 
     return {
         "messages": new_messages,
@@ -183,5 +290,15 @@ workflow.add_edge("clustering_agent", "supervisor")
 workflow.add_edge("visualization_agent", "supervisor")
 
 # Compile
-memory = MemorySaver()
-graph = workflow.compile(checkpointer=memory)
+# Checkpoints live in SQLite rather than process memory, so long sessions don't
+# grow the Streamlit worker and threads can be resumed after a restart.
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_state.db")
+
+@contextlib.asynccontextmanager
+async def open_graph():
+    """
+    Compiles the workflow with an async SQLite checkpointer. The connection is
+    bound to the running event loop, so open it inside the loop that streams.
+    """
+    async with AsyncSqliteSaver.from_conn_string(DB_PATH) as memory:
+        yield workflow.compile(checkpointer=memory)
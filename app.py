@@ -1,10 +1,14 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import uuid
+import functools
+import asyncio
 import plotly.graph_objects as go
+import plotly.express as px
 import json
-from agents import graph
+from agents import open_graph
 from langchain_core.messages import HumanMessage, AIMessage
 
 # 1. Page Configuration
@@ -16,6 +20,21 @@ Upload a CSV and ask your AI Supervisor to perform clustering or visualizations.
 The supervisor orchestrated specialists (`Clustering Agent` & `Visualization Agent`) to get the job done.
 """)
 
+# Small bound: entries are whole DataFrames (upload, cleaned file, PCA sidecar)
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_table(path: str, mtime: float) -> pd.DataFrame:
+    """Parse a file once per (path, mtime); new or rewritten files invalidate the cache."""
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, dtype_backend="pyarrow")
+    return pd.read_csv(path, dtype_backend="pyarrow")
+
+def load_table(path: str) -> pd.DataFrame:
+    return _load_table(path, os.path.getmtime(path))
+
+def _csv_bytes(path: str) -> bytes:
+    """CSV export of an intermediate file for the download button (deferred to click where supported)."""
+    return _load_table(path, os.path.getmtime(path)).to_csv(index=False).encode("utf-8")
+
 # 2. Sidebar - Configuration & Upload
 with st.sidebar:
     st.header("1. Data Input")
@@ -26,8 +45,12 @@ with st.sidebar:
         temp_dir = os.path.abspath("temp_data")
         os.makedirs(temp_dir, exist_ok=True)
         file_path = os.path.join(temp_dir, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+        # Only write on a new upload; rewriting every rerun would bump the mtime
+        # and defeat the (path, mtime) read cache
+        if st.session_state.get("upload_id") != uploaded_file.file_id or not os.path.exists(file_path):
+            with open(file_path, "wb") as f:
+                f.write(uploaded_file.getbuffer())
+            st.session_state.upload_id = uploaded_file.file_id
         st.success(f"File uploaded: {uploaded_file.name}")
         st.session_state.df_path = file_path
     else:
@@ -35,7 +58,7 @@ with st.sidebar:
 
 # 3. Main Area - Data Preview
 if st.session_state.df_path:
-    df = pd.read_csv(st.session_state.df_path)
+    df = load_table(st.session_state.df_path)
     st.subheader("Data Preview")
     st.dataframe(df.head(10), use_container_width=True)
     st.caption(f"Rows: {df.shape[0]} | Columns: {list(df.columns)}")
@@ -47,6 +70,9 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "thread_id" not in st.session_state:
     st.session_state.thread_id = str(uuid.uuid4())
+if "seen_prompts" not in st.session_state:
+    # Set of user prompts already in the history, for O(1) de-duplication
+    st.session_state.seen_prompts = set()
 if "auto_triggered" not in st.session_state:
     st.session_state.auto_triggered = False
 
@@ -58,7 +84,8 @@ for msg in st.session_state.messages:
 def process_request(prompt: str):
     """Refactored agent execution logic for both manual and auto triggers."""
     # User message
-    if not any(m["content"] == prompt for m in st.session_state.messages):
+    if prompt not in st.session_state.seen_prompts:
+        st.session_state.seen_prompts.add(prompt)
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
@@ -78,58 +105,63 @@ def process_request(prompt: str):
             "df_path": st.session_state.df_path
         }
 
-        final_output = ""
-        
-        # Stream the graph execution
-        for event in graph.stream(initial_state, config=config, stream_mode="updates"):
-            for node_name, output in event.items():
-                # Trace output
-                with trace_placeholder:
-                    if node_name == "supervisor":
-                        next_node = output.get("next_node", "Unknown")
-                        st.write(f"**Supervisor:** Decided to call `{next_node}`")
+        async def _stream() -> str:
+            final_output = ""
+            
+            # Stream the graph execution (awaits LLM calls instead of blocking on sync ones)
+            async with open_graph() as graph:
+                async for event in graph.astream(initial_state, config=config, stream_mode="updates"):
+                    for node_name, output in event.items():
+                        # Trace output
+                        with trace_placeholder:
+                            if node_name == "supervisor":
+                                next_node = output.get("next_node", "Unknown")
+                                st.write(f"**Supervisor:** Decided to call `{next_node}`")
                     
-                    elif node_name == "cleaning_agent":
-                        st.write("🧹 **Cleaning Agent:** Analyzing data quality...")
-                        if "df_path" in output:
-                            st.session_state.df_path = output["df_path"]
-                        # Display Summary in Main Chat
-                        if "messages" in output and output["messages"]:
-                            last_msg = output["messages"][-1]
-                            if isinstance(last_msg, AIMessage):
-                                st.markdown(f"### 🧹 Cleaning & EDA Report\n{last_msg.content}")
-                                st.divider()
-
-                    elif node_name == "clustering_agent":
-                        st.write("**Clustering Agent:** Preparing for K-Means analysis...")
-                        if "df_path" in output:
-                            st.session_state.df_path = output["df_path"]
-                        # Display Summary in Main Chat
-                        if "messages" in output and output["messages"]:
-                            last_msg = output["messages"][-1]
-                            if isinstance(last_msg, AIMessage):
-                                st.markdown(f"### Clustering Report\n{last_msg.content}")
-                                st.divider()
-
-                    elif node_name == "visualization_agent":
-                        st.write("🎨 **Visualization Agent:** Initiating Plotly rendering...")
-                        # Display Summary in Main Chat
-                        if "messages" in output and output["messages"]:
-                            last_msg = output["messages"][-1]
-                            if isinstance(last_msg, AIMessage):
-                                st.markdown(f"### 🎨 Visualization Report\n{last_msg.content}")
-                                st.divider()
+                            elif node_name == "cleaning_agent":
+                                st.write("🧹 **Cleaning Agent:** Analyzing data quality...")
+                                if "df_path" in output:
+                                    st.session_state.df_path = output["df_path"]
+                                # Display Summary in Main Chat
+                                if "messages" in output and output["messages"]:
+                                    last_msg = output["messages"][-1]
+                                    if isinstance(last_msg, AIMessage):
+                                        st.markdown(f"### 🧹 Cleaning & EDA Report\n{last_msg.content}")
+                                        st.divider()
+
+                            elif node_name == "clustering_agent":
+                                st.write("**Clustering Agent:** Preparing for K-Means analysis...")
+                                if "df_path" in output:
+                                    st.session_state.df_path = output["df_path"]
+                                # Display Summary in Main Chat
+                                if "messages" in output and output["messages"]:
+                                    last_msg = output["messages"][-1]
+                                    if isinstance(last_msg, AIMessage):
+                                        st.markdown(f"### Clustering Report\n{last_msg.content}")
+                                        st.divider()
+
+                            elif node_name == "visualization_agent":
+                                st.write("🎨 **Visualization Agent:** Initiating Plotly rendering...")
+                                # Display Summary in Main Chat
+                                if "messages" in output and output["messages"]:
+                                    last_msg = output["messages"][-1]
+                                    if isinstance(last_msg, AIMessage):
+                                        st.markdown(f"### 🎨 Visualization Report\n{last_msg.content}")
+                                        st.divider()
                 
-                # Store messages and show tool calls in trace
-                if "messages" in output:
-                    for m in output["messages"]:
-                        if isinstance(m, AIMessage):
-                            final_output = m.content
-                            # Check for tool calls and show them in trace
-                            if hasattr(m, 'tool_calls') and m.tool_calls:
-                                for tc in m.tool_calls:
-                                    with trace_placeholder:
-                                        st.code(f"🔨 Calling Tool: {tc['name']}\nArguments: {json.dumps(tc['args'], indent=2)}", language="json")
+                        # Store messages and show tool calls in trace
+                        if "messages" in output:
+                            for m in output["messages"]:
+                                if isinstance(m, AIMessage):
+                                    final_output = m.content
+                                    # Check for tool calls and show them in trace
+                                    if hasattr(m, 'tool_calls') and m.tool_calls:
+                                        for tc in m.tool_calls:
+                                            with trace_placeholder:
+                                                st.code(f"🔨 Calling Tool: {tc['name']}\nArguments: {json.dumps(tc['args'], indent=2)}", language="json")
+            return final_output
+
+        final_output = asyncio.run(_stream())
 
         # Final response
         if final_output:
@@ -144,7 +176,7 @@ def process_request(prompt: str):
         if "signals generated for ui" in final_output.lower():
             st.divider()
             st.subheader("Exploratory Data Analysis")
-            df_eda = pd.read_csv(st.session_state.df_path)
+            df_eda = load_table(st.session_state.df_path)
             num_df = df_eda.select_dtypes(include=[np.number])
             
             if not num_df.empty:
@@ -159,11 +191,12 @@ def process_request(prompt: str):
                     st.plotly_chart(fig_dist, use_container_width=True)
 
         # 2. Cluster Visualizations
-        if st.session_state.df_path and "_clustered.csv" in st.session_state.df_path:
+        if st.session_state.df_path and "_clustered." in st.session_state.df_path:
             st.divider()
             st.subheader("Cluster Analysis")
-            df_viz = pd.read_csv(st.session_state.df_path)
-            import plotly.express as px
+            # Prefer the thin PCA sidecar written by perform_clustering over the full file
+            pca_path = f"{st.session_state.df_path}.pca.parquet"
+            df_viz = load_table(pca_path if os.path.exists(pca_path) else st.session_state.df_path)
             fig = px.scatter(
                 df_viz, x="PCA1", y="PCA2", color="Cluster", 
                 title="2D PCA Cluster Map",
@@ -174,13 +207,18 @@ def process_request(prompt: str):
             st.success("Analysis and Visualization Complete!")
             
             # Allow user to download the final result
-            with open(st.session_state.df_path, "rb") as f:
-                st.download_button(
-                    label="Download Processed Data",
-                    data=f,
-                    file_name=os.path.basename(st.session_state.df_path),
-                    mime="text/csv"
-                )
+            df_path = st.session_state.df_path
+            download_kwargs = dict(
+                label="Download Processed Data",
+                file_name=f"{os.path.splitext(os.path.basename(df_path))[0]}.csv",
+                mime="text/csv"
+            )
+            try:
+                # Deferred: the CSV is only serialized when the user clicks Download
+                st.download_button(data=functools.partial(_csv_bytes, df_path), **download_kwargs)
+            except Exception:
+                # Older Streamlit releases only accept str/bytes/file data; build it eagerly
+                st.download_button(data=_csv_bytes(df_path), **download_kwargs)
 
 # 5. Autonomous / Manual Trigger
 if st.session_state.df_path and not st.session_state.auto_triggered:
@@ -200,5 +238,6 @@ with st.sidebar:
     st.write(f"**Current CSV:** {os.path.basename(st.session_state.df_path) if st.session_state.df_path else 'None'}")
     if st.button("Clear Conversation"):
         st.session_state.messages = []
+        st.session_state.seen_prompts = set()
         st.session_state.thread_id = str(uuid.uuid4())
         st.rerun()
@@ -2,8 +2,12 @@ from typing import Annotated, Sequence, TypedDict
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
 
+def _latest(old: str, new: str) -> str:
+    """Reducer for scalar fields: the most recent write wins."""
+    return new
+
 class AgentState(TypedDict):
     """The state of the data analytics agentic graph."""
     messages: Annotated[Sequence[BaseMessage], add_messages]
     next_node: str
-    df_path: str  # Path to the current active CSV file
+    df_path: Annotated[str, _latest]  # Path to the current active data file (CSV upload or Parquet intermediate)
@@ -1,11 +1,69 @@
 import pandas as pd
 import numpy as np
 import os
+import functools
+from joblib import Parallel, delayed
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.cluster import KMeans
-from sklearn.decomposition import PCA
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.compose import ColumnTransformer
+from sklearn.decomposition import TruncatedSVD
 from langchain_core.tools import tool
 import plotly.express as px
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional; the NumPy path is used without it
+    njit = None
+
+def _read_table(file_path: str, columns: list[str] = None) -> pd.DataFrame:
+    """Loads a CSV (or Parquet) file, optionally only some columns, into an Arrow-backed DataFrame."""
+    if file_path.endswith(".parquet"):
+        return pd.read_parquet(file_path, columns=columns, dtype_backend="pyarrow")
+    return pd.read_csv(file_path, usecols=columns, engine="pyarrow", dtype_backend="pyarrow")
+
+@functools.lru_cache(maxsize=32)
+def _dtype_partition(file_path: str, mtime: float) -> tuple[tuple, tuple, int]:
+    """
+    Splits a Parquet file's columns into numeric and non-numeric using only its
+    schema/footer metadata (no data is read). Also returns the row count.
+    Keyed on (path, mtime) so a rewritten file invalidates the entry.
+    """
+    pf = pq.ParquetFile(file_path)
+    schema = pf.schema_arrow
+    num_cols = tuple(
+        f.name for f in schema
+        if pa.types.is_integer(f.type) or pa.types.is_floating(f.type) or pa.types.is_decimal(f.type)
+    )
+    other_cols = tuple(name for name in schema.names if name not in num_cols)
+    return num_cols, other_cols, pf.metadata.num_rows
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _iqr_mask_kernel(arr, lo, hi):
+        n_rows, n_cols = arr.shape
+        keep = np.empty(n_rows, dtype=np.bool_)
+        for i in prange(n_rows):
+            row_ok = True
+            for j in range(n_cols):
+                row_ok &= (arr[i, j] >= lo[j]) & (arr[i, j] <= hi[j])
+            keep[i] = row_ok
+        return keep
+else:
+    _iqr_mask_kernel = None
+
+def _iqr_mask(arr: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Boolean row mask: True where every column lies within [lo, hi]."""
+    if _iqr_mask_kernel is not None:
+        return _iqr_mask_kernel(arr, lo, hi)
+    return ((arr >= lo) & (arr <= hi)).all(axis=1)
+
+def _compute_fill(series: pd.Series, impute_num: str, impute_cat: str):
+    """Returns the value used to fill nulls in a single column."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.median() if impute_num == "median" else series.mean()
+    return series.mode()[0] if impute_cat == "mode" else "Missing"
 
 @tool
 def clean_data(file_path: str, drop_null_thresh: float = 0.5, impute_num: str = "median", impute_cat: str = "mode", convert_dates: list[str] = None, drop_columns: list[str] = None, remove_outliers: bool = True) -> str:
@@ -19,7 +77,7 @@ def clean_data(file_path: str, drop_null_thresh: float = 0.5, impute_num: str =
     - remove_outliers: whether to apply IQR-based removal.
     """
     try:
-        df = pd.read_csv(file_path)
+        df = _read_table(file_path)
         if df.empty:
             return f"Error: The file at {file_path} is empty."
 
@@ -33,14 +91,18 @@ def clean_data(file_path: str, drop_null_thresh: float = 0.5, impute_num: str =
         limit = len(df) * drop_null_thresh
         df = df.dropna(axis=1, thresh=limit)
         
-        for col in df.columns:
-            if df[col].isnull().any():
-                if np.issubdtype(df[col].dtype, np.number):
-                    fill_val = df[col].median() if impute_num == "median" else df[col].mean()
-                    df[col] = df[col].fillna(fill_val)
-                else:
-                    fill_val = df[col].mode()[0] if impute_cat == "mode" else "Missing"
-                    df[col] = df[col].fillna(fill_val)
+        # Fill values are independent per column: compute them in parallel, apply in one fillna
+        cols_with_nulls = df.columns[df.isnull().any()].tolist()
+        if cols_with_nulls:
+            # Arrow keeps integer columns with nulls as int64; a fractional median/mean
+            # fill would be truncated, so widen them to float first (as the numpy backend does)
+            int_nulls = [c for c in cols_with_nulls if pd.api.types.is_integer_dtype(df[c])]
+            if int_nulls:
+                df = df.astype({c: "float64[pyarrow]" for c in int_nulls})
+            vals = Parallel(n_jobs=-1, prefer="threads")(
+                delayed(_compute_fill)(df[c], impute_num, impute_cat) for c in cols_with_nulls
+            )
+            df = df.fillna(dict(zip(cols_with_nulls, vals)))
         
         # 2. Data Validation
         if convert_dates:
@@ -52,30 +114,34 @@ def clean_data(file_path: str, drop_null_thresh: float = 0.5, impute_num: str =
         if remove_outliers and not df.empty:
             original_len = len(df)
             num_cols = df.select_dtypes(include=[np.number]).columns
-            for col in num_cols:
-                Q1 = df[col].quantile(0.25)
-                Q3 = df[col].quantile(0.75)
-                IQR = Q3 - Q1
-                lower_bound = Q1 - 1.5 * IQR
-                upper_bound = Q3 + 1.5 * IQR
-                
-                temp_df = df[(df[col] >= lower_bound) & (df[col] <= upper_bound)]
-                # Safety check: Don't remove if it drops > 90% of current data or results in < 5 rows
-                if len(temp_df) > 5 and len(temp_df) > (len(df) * 0.1):
-                    df = temp_df
+            if len(num_cols):
+                # Quantiles for all numeric columns in one pass, then a single row mask
+                num_df = df[num_cols]
+                q = num_df.quantile([0.25, 0.75])
+                iqr = q.loc[0.75] - q.loc[0.25]
+                lower_bound = q.loc[0.25] - 1.5 * iqr
+                upper_bound = q.loc[0.75] + 1.5 * iqr
+                arr = np.ascontiguousarray(num_df.to_numpy(dtype=np.float64, na_value=np.nan))
+                mask = _iqr_mask(arr, lower_bound.to_numpy(dtype=np.float64), upper_bound.to_numpy(dtype=np.float64))
+
+                # Safety check: Don't remove if it drops > 90% of data or results in < 5 rows
+                kept = int(mask.sum())
+                if kept > 5 and kept > (original_len * 0.1):
+                    df = df[mask]
 
         if df.empty:
             return "Error: Cleaning process resulted in an empty dataset. Check your null threshold or outlier settings."
 
         # 4. Save
-        # Robust absolute path handling
+        # Robust absolute path handling. Intermediates are Snappy-compressed Parquet;
+        # CSV is only produced when the user downloads the final result.
         base, ext = os.path.splitext(file_path)
         if base.endswith("_cleaned"):
-            output_path = file_path
+            output_path = f"{base}.parquet"
         else:
-            output_path = f"{base}_cleaned{ext}"
+            output_path = f"{base}_cleaned.parquet"
             
-        df.to_csv(output_path, index=False)
+        df.to_parquet(output_path, compression="snappy", engine="pyarrow", index=False)
         msg = f"Data cleaning complete. Saved to: {output_path}."
         if drop_columns:
             msg += f" Dropped: {existing_drops}."
@@ -91,25 +157,40 @@ def perform_eda(file_path: str) -> str:
     Generates signals for the UI to render distribution and correlation plots.
     """
     try:
-        df = pd.read_csv(file_path)
-        num_df = df.select_dtypes(include=[np.number])
+        if file_path.endswith(".parquet"):
+            # Types come from the Parquet schema, so only the numeric columns are loaded
+            num_cols, other_cols, n_rows = _dtype_partition(file_path, os.path.getmtime(file_path))
+            num_df = _read_table(file_path, columns=list(num_cols))
+            shape = (n_rows, len(num_cols) + len(other_cols))
+        else:
+            df = _read_table(file_path)
+            num_df = df.select_dtypes(include=[np.number])
+            shape = df.shape
         
         if num_df.empty:
             return "No numerical data available for EDA."
             
         # Correlation
-        corr = num_df.corr()
-        high_corr_pairs = []
-        drop_suggestions = set()
-        
-        for i in range(len(corr.columns)):
-            for j in range(i):
-                if abs(corr.iloc[i, j]) > 0.85:
-                    col_i = corr.columns[i]
-                    col_j = corr.columns[j]
-                    high_corr_pairs.append(f"{col_i} & {col_j} ({corr.iloc[i, j]:.2f})")
-                    # Suggest dropping the second column in the pair
-                    drop_suggestions.add(col_j)
+        cols = num_df.columns.to_numpy()
+        if num_df.isnull().to_numpy().any():
+            # pandas handles missing values pairwise; keep it for unclean data
+            arr = num_df.corr().to_numpy()
+        else:
+            # Pearson correlation as a single float32 GEMM on standardized columns.
+            # Center/scale in float64 first: large-offset columns (e.g. epoch seconds)
+            # lose too much precision if cast before centering.
+            X = num_df.to_numpy(dtype=np.float64)
+            X = X - X.mean(axis=0)
+            X /= X.std(axis=0) + 1e-12
+            X = X.astype(np.float32)
+            arr = (X.T @ X) / X.shape[0]
+        # Scan the lower triangle in one vectorized pass (same pairs/order as walking j < i)
+        i_idx, j_idx = np.where(np.tril(np.abs(arr) > 0.85, k=-1))
+        high_corr_pairs = [
+            f"{cols[i]} & {cols[j]} ({arr[i, j]:.2f})" for i, j in zip(i_idx, j_idx)
+        ]
+        # Suggest dropping the second column in the pair
+        drop_suggestions = set(cols[j_idx].tolist())
         
         report = "EDA Report:\n"
         if high_corr_pairs:
@@ -118,58 +199,94 @@ def perform_eda(file_path: str) -> str:
         else:
             report += "- No extreme multicollinearity detected (>0.85).\n"
         
-        report += f"- Data Shape: {df.shape}\n"
+        report += f"- Data Shape: {shape}\n"
         report += "- Signals generated for UI: Correlation Heatmap and Feature Distributions."
         
         return report
     except Exception as e:
         return f"Error during EDA: {str(e)}"
 
+# Columns added by perform_clustering; never used as clustering features
+_CLUSTER_OUTPUT_COLS = ("Cluster", "PCA1", "PCA2")
+
+def _clustering_source(file_path: str) -> str:
+    """Maps a '_clustered' output back to the file it was clustered from, if it still exists."""
+    base = os.path.splitext(file_path)[0]
+    if base.endswith("_clustered"):
+        for ext in (".parquet", ".csv"):
+            candidate = base[:-len("_clustered")] + ext
+            if os.path.exists(candidate):
+                return candidate
+    return file_path
+
+@functools.lru_cache(maxsize=4)
+def _preprocess_for_clustering(file_path: str, mtime: float, columns: tuple):
+    """
+    Builds the clustering feature matrix and its 2D projection. Only these are
+    cached (not the loaded frame), keyed on (path, mtime, columns) so a
+    rewritten file invalidates the entry. Callers must not mutate the results.
+    """
+    data = _read_table(file_path, columns=list(columns))[list(columns)]
+
+    # 1. Identify types
+    num_cols = data.select_dtypes(include=[np.number]).columns.tolist()
+    cat_cols = data.select_dtypes(exclude=[np.number]).columns.tolist()
+    if cat_cols:
+        # Arrow-backed strings carry missing values as pd.NA, which OneHotEncoder rejects;
+        # hand it plain object columns with np.nan like the NumPy backend produced
+        data = data.copy()
+        data[cat_cols] = data[cat_cols].astype(object).where(data[cat_cols].notna(), np.nan)
+
+    # 2. Preprocessing
+    # Sparse one-hot keeps high-cardinality categoricals cheap; the transformer
+    # returns a sparse matrix when the result is mostly zeros, dense otherwise.
+    transformers = []
+    if num_cols:
+        transformers.append(("num", StandardScaler(), num_cols))
+    if cat_cols:
+        transformers.append(("cat", OneHotEncoder(sparse_output=True, handle_unknown="ignore"), cat_cols))
+    ct = ColumnTransformer(transformers)
+
+    # float32 halves memory traffic for the K-Means and SVD passes
+    processed = ct.fit_transform(data).astype(np.float32)
+
+    # 2D projection for Visualization (TruncatedSVD works directly on sparse input)
+    svd = TruncatedSVD(n_components=2, random_state=42)
+    pca_result = svd.fit_transform(processed)
+    return processed, pca_result
+
 @tool
 def perform_clustering(file_path: str, columns: list[str], k: int) -> str:
     """
-    Performs K-Means clustering on specified columns of a CSV file.
+    Performs K-Means clustering on specified columns of a data file.
     Identifies numerical vs categorical columns, preprocesses them, 
-    applies dimensionality reduction (PCA 2D), and saves results.
-    Returns the path to the new CSV file.
+    applies dimensionality reduction (2D, stored as PCA1/PCA2), and saves results.
+    Returns the path to the new Parquet file.
     """
     try:
-        df = pd.read_csv(file_path)
-        data = df[columns].copy()
-
-        # 1. Identify types
-        num_cols = data.select_dtypes(include=[np.number]).columns.tolist()
-        cat_cols = data.select_dtypes(exclude=[np.number]).columns.tolist()
-
-        # 2. Preprocessing
-        processed_parts = []
-        if num_cols:
-            scaler = StandardScaler()
-            scaled = scaler.fit_transform(data[num_cols])
-            processed_parts.append(pd.DataFrame(scaled, columns=num_cols))
-        
-        if cat_cols:
-            encoder = OneHotEncoder(sparse_output=False)
-            encoded = encoder.fit_transform(data[cat_cols])
-            encoded_cols = encoder.get_feature_names_out(cat_cols)
-            processed_parts.append(pd.DataFrame(encoded, columns=encoded_cols))
+        # Re-clustering (e.g. "try 4 clusters") starts again from the pre-clustering source,
+        # so results don't chain into _clustered_clustered files and the cache below is reused
+        source_path = _clustering_source(file_path)
+        columns = [c for c in columns if c not in _CLUSTER_OUTPUT_COLS]
 
-        processed_df = pd.concat(processed_parts, axis=1)
+        # Preprocessing and the 2D projection don't depend on k; reuse them across re-runs
+        processed, pca_result = _preprocess_for_clustering(source_path, os.path.getmtime(source_path), tuple(columns))
+        df = _read_table(source_path).drop(columns=list(_CLUSTER_OUTPUT_COLS), errors="ignore")
 
         # 3. K-Means
-        kmeans = KMeans(n_clusters=k, random_state=42)
-        clusters = kmeans.fit_predict(processed_df)
+        kmeans = MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=4096, n_init=3)
+        clusters = kmeans.fit_predict(processed)
         df['Cluster'] = clusters
 
-        # 4. PCA for Visualization
-        pca = PCA(n_components=2)
-        pca_result = pca.fit_transform(processed_df)
+        # 4. 2D projection for Visualization
         df['PCA1'] = pca_result[:, 0]
         df['PCA2'] = pca_result[:, 1]
 
         # 5. Save Results
-        output_path = file_path.replace(".csv", "_clustered.csv")
-        df.to_csv(output_path, index=False)
+        output_path = f"{os.path.splitext(source_path)[0]}_clustered.parquet"
+        df.to_parquet(output_path, compression="snappy", engine="pyarrow", index=False)
+        # Thin sidecar with just the plot columns so the UI doesn't re-parse the full file
+        df[['PCA1', 'PCA2', 'Cluster']].to_parquet(f"{output_path}.pca.parquet", index=False)
         
         return f"Clustering complete. Results saved to: {output_path}. PCA components (PCA1, PCA2) and 'Cluster' labels added."
     except Exception as e:
@@ -178,11 +295,13 @@ def perform_clustering(file_path: str, columns: list[str], k: int) -> str:
 @tool
 def generate_visualization(file_path: str) -> str:
     """
-    Generates a 2D scatter plot from PCA components in a clustered CSV file.
+    Generates a 2D scatter plot from PCA components in a clustered data file.
     Expects 'PCA1', 'PCA2', and 'Cluster' columns to exist.
     """
     try:
-        df = pd.read_csv(file_path)
+        # Only the plot columns are needed; use the PCA sidecar when clustering wrote one
+        pca_path = f"{file_path}.pca.parquet"
+        df = _read_table(pca_path if os.path.exists(pca_path) else file_path)
         if 'PCA1' not in df.columns or 'PCA2' not in df.columns or 'Cluster' not in df.columns:
             return "Error: File does not contain 'PCA1', 'PCA2' or 'Cluster' columns. Perform clustering first."
         